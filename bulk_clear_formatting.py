@@ -7,7 +7,8 @@
 # VCS+issues: https://github.com/Araeos/ankiplugins
 # Licence: GNU General Public Licence (GNU GPL), version 3
 
-from typing import List, Optional, Sequence, cast
+from typing import Dict, List, Optional, Sequence, Tuple, cast
+import functools
 import re
 
 from PyQt6.QtGui import QAction
@@ -23,9 +24,11 @@ from PyQt6.QtWidgets import (
     QCheckBox,
 )
 from anki.hooks import addHook
+from anki.models import NotetypeId
 from anki.notes import NoteId
+from anki.utils import ids2str, split_fields
 from aqt import mw
-from aqt.utils import tooltip, askUser
+from aqt.utils import tooltip, askUser, showCritical
 from aqt.browser.browser import Browser
 
 
@@ -37,6 +40,27 @@ def gc(key, default=None):
     return conf.get(key, default)
 
 
+# Number of notes read from the database per query during a bulk clear
+_FETCH_CHUNK_SIZE = 500
+
+# Maximum characters (raw plus cleaned) memoized during a bulk clear. Once
+# full, no new entries are added; clearing instead would keep evicting the
+# repeated fields whenever their distinct contents exceed the budget
+_STRIP_CACHE_CHARS = 2_000_000
+
+# A tag is everything from '<' up to the next '>'; a '<' without a closing
+# '>' is not a tag and is left in place. [^>]* avoids the backtracking of .*?
+_STRIP_RE = re.compile(r"<(?!img\b)[^>]*>", re.IGNORECASE)
+_STRIP_RE_PRESERVE_BR = re.compile(r"<(?!(?:img|br)\b)[^>]*>", re.IGNORECASE)
+
+# Bound substitutions per preserve_br setting, so hot loops can pick one
+# once instead of branching on every field
+_STRIPPERS = {
+    False: functools.partial(_STRIP_RE.sub, ""),
+    True: functools.partial(_STRIP_RE_PRESERVE_BR.sub, ""),
+}
+
+
 def stripFormatting(txt, preserve_br=False):
     """
     Removes all html tags, except if they begin like this: <img...>
@@ -54,11 +78,10 @@ def stripFormatting(txt, preserve_br=False):
     string
         the modified string as described above
     """
-    if preserve_br:
-        # Exclude img and br tags from removal
-        return re.sub("<(?!img|br).*?>", "", txt)
-    else:
-        return re.sub("<(?!img).*?>", "", txt)
+    if "<" not in txt:
+        # No tags at all, skip the regex engine
+        return txt
+    return _STRIPPERS[preserve_br](txt)
 
 
 class ClearFormattingDialog(QDialog):
@@ -68,11 +91,12 @@ class ClearFormattingDialog(QDialog):
         super().__init__(parent=browser)
         self._browser = browser
         self._nids = nids
+        # True while a clear operation is running in the background
+        self._running = False
         
         # Get fields from the first selected note
         fields = self.get_fields()
         if fields is None:
-            from aqt.utils import showCritical
             showCritical("Error: Could not determine note type of selected notes", parent=self)
             self.close()
             return
@@ -137,6 +161,18 @@ class ClearFormattingDialog(QDialog):
         fields = mw.col.models.field_names(model)
         return fields
     
+    def reject(self):
+        """Ignore Escape while an operation is running"""
+        if not self._running:
+            super().reject()
+    
+    def closeEvent(self, event):
+        """Keep the dialog open while an operation is running"""
+        if self._running:
+            event.ignore()
+            return
+        super().closeEvent(event)
+    
     def on_checkbox_changed(self, state):
         """Enable/disable field selector based on checkbox"""
         self.field_selector.setEnabled(not self.checkbox_all.isChecked())
@@ -147,57 +183,178 @@ class ClearFormattingDialog(QDialog):
         preserve_br = self.checkbox_preserve_br.isChecked()
         field_name = self.field_selector.currentText() if not clear_all else None
         
-        # Confirmation dialog
-        if clear_all:
-            q = (
-                f"This will clear formatting in <b>ALL fields</b> "
-                f"of <b>{len(self._nids)} selected note(s)</b>. Proceed?"
-            )
-        else:
-            q = (
-                f"This will clear formatting in the <b>'{field_name}'</b> field "
-                f"of <b>{len(self._nids)} selected note(s)</b>. Proceed?"
-            )
-        
-        if not askUser(q, parent=self):
-            return
-        
-        # Perform the operation
-        mw.checkpoint("Clear Formatting")
+        # Work out the changes in the background, keeping the UI responsive.
+        # The dialog stays locked until it finishes so it can't be re-run
+        # or closed while notes are being changed
+        self.set_running(True)
         mw.progress.start()
         
-        count = 0
-        for nid in self._nids:
-            note = mw.col.get_note(nid)
+        def on_collected(fut):
+            mw.progress.finish()
+            self.set_running(False)
+            try:
+                changes = fut.result()
+            except Exception as e:
+                showCritical(f"Error while clearing formatting: {e}", parent=self)
+                return
+            if not changes:
+                # Skip the confirmation, undo checkpoint and reset for a no-op
+                tooltip("No formatting to clear", parent=self)
+                return
             
+            # Confirmation dialog
             if clear_all:
-                # Clear all fields
-                for i, field in enumerate(note.fields):
-                    result = stripFormatting(field, preserve_br)
-                    if result != field:
-                        note.fields[i] = result
-                        count += 1
+                q = (
+                    f"This will clear formatting in <b>ALL fields</b> "
+                    f"of <b>{len(changes)} of {len(self._nids)} selected note(s)</b>. Proceed?"
+                )
             else:
-                # Clear specific field
-                field_names = mw.col.models.field_names(note.note_type())
-                if field_name in field_names:
-                    field_index = field_names.index(field_name)
-                    result = stripFormatting(note.fields[field_index], preserve_br)
-                    if result != note.fields[field_index]:
-                        note.fields[field_index] = result
-                        count += 1
+                q = (
+                    f"This will clear formatting in the <b>'{field_name}'</b> field "
+                    f"of <b>{len(changes)} of {len(self._nids)} selected note(s)</b>. Proceed?"
+                )
+            
+            if not askUser(q, parent=self):
+                return
             
-            note.flush()
+            mw.checkpoint("Clear Formatting")
+            self.set_running(True)
+            mw.progress.start(label=f"Saving {len(changes)} note(s)")
+            mw.taskman.run_in_background(
+                lambda: self.save_changes(changes), on_saved
+            )
         
-        mw.progress.finish()
-        mw.reset()
+        def on_saved(fut):
+            mw.progress.finish()
+            self.set_running(False)
+            try:
+                count = fut.result()
+            except Exception as e:
+                showCritical(f"Error while clearing formatting: {e}", parent=self)
+                return
+            mw.reset()
+            
+            # Close dialog and show tooltip
+            self.close()
+            if clear_all:
+                tooltip(f"<b>Cleared formatting</b> in {count} note(s).", parent=self._browser)
+            else:
+                tooltip(f"<b>Cleared formatting</b> in '{field_name}' field of {count} note(s).", parent=self._browser)
+        
+        mw.taskman.run_in_background(
+            lambda: self.collect_changes(clear_all, preserve_br, field_name),
+            on_collected,
+        )
+    
+    def set_running(self, running: bool):
+        """Lock or unlock the dialog around a background operation"""
+        self._running = running
+        self.setEnabled(not running)
+    
+    def collect_changes(
+        self, clear_all: bool, preserve_br: bool, field_name: Optional[str]
+    ) -> List[Tuple[NoteId, List[str]]]:
+        """Return (note id, cleaned fields) for every selected note that would change"""
+        changes = []
+        
+        # Remember the cleaned version of each distinct input for this run,
+        # bounded by total characters rather than entry count
+        cache: Dict[str, str] = {}
+        cache_get = cache.get
+        cache_chars = 0
+        strip_field = _STRIPPERS[preserve_br]
+        
+        def strip(field: str) -> str:
+            nonlocal cache_chars
+            if "<" not in field:
+                return field
+            cleaned = cache_get(field)
+            if cleaned is None:
+                cleaned = strip_field(field)
+                size = len(field) + len(cleaned)
+                if cache_chars + size <= _STRIP_CACHE_CHARS:
+                    cache[field] = cleaned
+                    cache_chars += size
+            return cleaned
+        
+        # Index of field_name per note type, None if the type lacks the field
+        field_indices: Dict[NotetypeId, Optional[int]] = {}
+        
+        def target_index(mid: NotetypeId) -> Optional[int]:
+            if mid not in field_indices:
+                model = mw.col.models.get(mid)
+                field_names = mw.col.models.field_names(model) if model else []
+                field_indices[mid] = (
+                    field_names.index(field_name)
+                    if field_name in field_names
+                    else None
+                )
+            return field_indices[mid]
         
-        # Close dialog and show tooltip
-        self.close()
-        if clear_all:
-            tooltip(f"<b>Cleared formatting</b> in {len(self._nids)} note(s).", parent=self._browser)
-        else:
-            tooltip(f"<b>Cleared formatting</b> in '{field_name}' field of {len(self._nids)} note(s).", parent=self._browser)
+        total = len(self._nids)
+        done = 0
+        
+        # Bind attributes used for every note to locals
+        db_all = mw.col.db.all
+        add_change = changes.append
+        
+        # Read raw fields in chunks; Note objects are only built once the
+        # user has confirmed, see save_changes
+        for start in range(0, total, _FETCH_CHUNK_SIZE):
+            chunk = self._nids[start:start + _FETCH_CHUNK_SIZE]
+            rows = db_all(
+                f"select id, mid, flds from notes where id in {ids2str(chunk)}"
+            )
+            for nid, mid, flds in rows:
+                # Only call into Qt every 64 notes
+                if done & 63 == 0:
+                    mw.taskman.run_on_main(
+                        lambda done=done: mw.progress.update(
+                            label=f"Checking {done}/{total}", value=done, max=total
+                        )
+                    )
+                done += 1
+                if "<" not in flds:
+                    # No tag in any field of this note
+                    continue
+                fields = split_fields(flds)
+                
+                if clear_all:
+                    # Clear all fields
+                    result = [strip(field) for field in fields]
+                    if result == fields:
+                        continue
+                else:
+                    # Clear specific field
+                    field_index = target_index(mid)
+                    if field_index is None:
+                        continue
+                    field = fields[field_index]
+                    if "<" not in field:
+                        continue
+                    cleaned = strip(field)
+                    if cleaned == field:
+                        continue
+                    result = fields
+                    result[field_index] = cleaned
+                
+                add_change((NoteId(nid), result))
+        
+        return changes
+    
+    def save_changes(self, changes: Sequence[Tuple[NoteId, List[str]]]) -> int:
+        """Apply the collected field changes and return the number of notes written"""
+        get_note = mw.col.get_note
+        notes = []
+        for nid, fields in changes:
+            note = get_note(nid)
+            note.fields = fields
+            notes.append(note)
+        
+        # Write all modified notes in one go instead of flushing each one;
+        # the backend applies the whole batch in a single transaction
+        mw.col.update_notes(notes)
+        return len(notes)
 
 
 def setupMenu(browser):
@@ -312,18 +469,13 @@ def clear_all_fields_editor(editor):
         return
     
     note = editor.note
-    changed = False
-    
-    for i, field in enumerate(note.fields):
-        # Always preserve <br> in editor context menu (safer default)
-        cleaned = stripFormatting(field, preserve_br=True)
-        if cleaned != field:
-            note.fields[i] = cleaned
-            changed = True
+    # Always preserve <br> in editor context menu (safer default)
+    cleaned = [stripFormatting(field, preserve_br=True) for field in note.fields]
     
-    if not changed:
+    if cleaned == note.fields:
         tooltip("No formatting to clear", parent=editor.widget)
         return
     
+    note.fields = cleaned
     editor.loadNoteKeepingFocus()
     tooltip("Cleared formatting in all fields", parent=editor.widget)